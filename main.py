@@ -1,7 +1,15 @@
-import pandas as pd
-import requests
-from difflib import SequenceMatcher
+import csv
+import heapq
+import httpx
+import numpy as np
+import orjson
+from rapidfuzz import fuzz, process
+import logging
 import re
+import shelve
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import os
 from dotenv import load_dotenv
@@ -9,6 +17,26 @@ from dotenv import load_dotenv
 # Load .env file
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# Shared HTTP/2 client so concurrent ICD searches multiplex over one verified connection
+HTTP_CLIENT = httpx.Client(
+    http2=True,
+    headers={
+        "Accept": "application/json",
+        "Accept-Language": "en",
+        "API-Version": "v2"
+    },
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+)
+
+# On-disk cache of ICD search results, keyed by search term
+ICD_CACHE_FILE = "icd_cache.db"
+ICD_CACHE_TTL = 86400  # seconds
+_cache_lock = threading.Lock()
+_token_lock = threading.Lock()
+
 # --------------------
 # Step 1. Authenticate
 # --------------------
@@ -19,58 +47,81 @@ def get_token():
         "scope": "icdapi_access",
         "grant_type": "client_credentials"
     }
-    r = requests.post(TOKEN_URL, data=data)
+    r = HTTP_CLIENT.post(TOKEN_URL, data=data)
     r.raise_for_status()
-    print("Token retrieved successfully and token is ", r.json()["access_token"])
-    return r.json()["access_token"]
+    log.info("Token retrieved successfully")
+    token = orjson.loads(r.content)["access_token"]
+    # Every later ICD call on the shared client is authenticated with this token
+    HTTP_CLIENT.headers["Authorization"] = f"Bearer {token}"
+    return token
+
+def ensure_token():
+    """Authenticate the shared client once, on the first search that actually needs the network"""
+    if "Authorization" in HTTP_CLIENT.headers:
+        return
+    with _token_lock:
+        # Another search thread may have fetched the token while we waited
+        if "Authorization" not in HTTP_CLIENT.headers:
+            get_token()
 
 # --------------------
 # Step 2. ICD-11 Search
 # --------------------
-def search_icd(term, token):
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-        "Accept-Language": "en",
-        "API-Version": "v2"
-    }
-    params = {"q": term, "flatResults": "true",    "chapterFilter": "26"  # restricts results to TM2
-}
-    r = requests.get(SEARCH_URL, headers=headers, params=params, verify=False)
+ICD_SEARCH_PARAMS = {"flatResults": "true", "chapterFilter": "26"}  # chapter 26 restricts results to TM2
+
+def fetch_icd_entities(term):
+    with _cache_lock, shelve.open(ICD_CACHE_FILE) as cache:
+        cached = cache.get(term)
+    if cached and time.time() - cached[0] < ICD_CACHE_TTL:
+        return cached[1]
+    
+    # Only a cache miss needs a token, so a fully cached run makes no HTTP calls
+    ensure_token()
+    r = HTTP_CLIENT.get(SEARCH_URL, params={**ICD_SEARCH_PARAMS, "q": term})
     r.raise_for_status()
-    return r.json().get("destinationEntities", [])
+    entities = orjson.loads(r.content).get("destinationEntities", [])
+    
+    with _cache_lock, shelve.open(ICD_CACHE_FILE) as cache:
+        cache[term] = (time.time(), entities)
+    return entities
+
+def search_icd(term):
+    """Return ICD search hits as flat (code, title, lowercased title) tuples"""
+    candidates = []
+    for c in fetch_icd_entities(term):
+        title = c.get("title", "")
+        candidates.append((c.get("theCode", ""), title, title.lower()))
+    return candidates
 
 # --------------------
 # Step 3. Extract Keywords from Definition
 # --------------------
+_STOP_WORDS = frozenset({'is', 'are', 'the', 'and', 'or', 'of', 'in', 'to', 'by', 'at', 'such', 'as', 'this', 'may', 'be', 'it', 'with', 'a', 'an', 'various', 'parts', 'body', 'functions', 'consequent', 'explained', 'marked', 'increase'})
+_MED_TERMS = ('roughness', 'hoarseness', 'voice', 'emaciation', 'blackish', 'discoloration', 'twitching', 'warmth', 'insomnia', 'strength', 'stools', 'physiological', 'pathological')
+# Whole words containing any medical term, found in one scan of the lowercased definition
+_MED_WORD_RE = re.compile(r'\b\w*(?:' + '|'.join(map(re.escape, _MED_TERMS)) + r')\w*')
+# Compound term emitted when all of its trigger words appear in the definition
+_COMPOUND_TERMS = (
+    ({'hoarseness', 'voice'}, 'hoarse voice'),
+    ({'hard', 'stools'}, 'hard stools'),
+    ({'physical', 'strength'}, 'weakness'),
+    ({'blackish', 'discoloration'}, 'skin discoloration'),
+)
+_COMPOUND_TRIGGERS = frozenset().union(*(words for words, _ in _COMPOUND_TERMS))
+
 def extract_keywords(definition):
     """Extract meaningful keywords from long definition for better ICD search"""
-    # Remove common words and focus on medical terms
-    stop_words = {'is', 'are', 'the', 'and', 'or', 'of', 'in', 'to', 'by', 'at', 'such', 'as', 'this', 'may', 'be', 'it', 'with', 'a', 'an', 'various', 'parts', 'body', 'functions', 'consequent', 'explained', 'marked', 'increase'}
-    
-    # Clean and tokenize
-    clean_def = re.sub(r'[^\w\s]', ' ', definition.lower())
-    words = clean_def.split()
-    
-    # Filter meaningful keywords
-    keywords = [word for word in words if len(word) > 3 and word not in stop_words]
+    definition_lower = definition.lower()
     
-    # Focus on medical-relevant terms for vAtavRuddhiH
-    medical_keywords = []
-    for word in keywords:
-        if any(term in word for term in ['roughness', 'hoarseness', 'voice', 'emaciation', 'blackish', 'discoloration', 'twitching', 'warmth', 'insomnia', 'strength', 'stools', 'physiological', 'pathological']):
-            medical_keywords.append(word)
+    # Focus on medical-relevant terms for vAtavRuddhiH. Punctuation is not a word character, so
+    # the regex splits on it directly; every match contains a medical term, so it is already
+    # longer than 3 characters. Deduplicate keeping first-seen order and drop common words.
+    medical_keywords = [word for word in dict.fromkeys(_MED_WORD_RE.findall(definition_lower))
+                        if word not in _STOP_WORDS]
     
     # Also add compound terms that might be relevant
-    compound_terms = []
-    if 'hoarseness' in definition.lower() and 'voice' in definition.lower():
-        compound_terms.append('hoarse voice')
-    if 'hard' in definition.lower() and 'stools' in definition.lower():
-        compound_terms.append('hard stools')
-    if 'physical' in definition.lower() and 'strength' in definition.lower():
-        compound_terms.append('weakness')
-    if 'blackish' in definition.lower() and 'discoloration' in definition.lower():
-        compound_terms.append('skin discoloration')
+    present = {word for word in _COMPOUND_TRIGGERS if word in definition_lower}
+    compound_terms = [term for words, term in _COMPOUND_TERMS if words <= present]
     
     # Combine single words and compound terms
     all_keywords = medical_keywords + compound_terms
@@ -80,101 +131,134 @@ def extract_keywords(definition):
 # --------------------
 # Step 4. Similarity
 # --------------------
-def similarity(a, b):
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+def score_titles(queries_lower, titles_lower):
+    """Score already-lowercased queries against already-lowercased titles in a single batched call, one row per query"""
+    return process.cdist(queries_lower, titles_lower, scorer=fuzz.ratio, dtype=np.float32) / 100.0
 
 # --------------------
 # Step 5. Build Mapping for Specific Entry
 # --------------------
+EARLY_EXIT = 0.95  # Stop searching once a candidate scores at least this high
+
 def build_mapping_specific():
     # Specific entry data
     nam_code = "SR12 (AAA-2)"
     nam_term = "vAtavRuddhiH"
     nam_def = "It is characterized by roughness or hoarseness of voice, emaciation, blackish discoloration of body, twitching in various parts of body, desire for warmth, insomnia, reduced physical strength, hard stools. This may be explained by marked increase of vatadosha functions and consequent physiological and pathological ramifications."
     
-    token = get_token()
-    print(f"\nProcessing NAMASTE entry: {nam_term}")
+    log.info("Processing NAMASTE entry: %s", nam_term)
     
     results = []
     best_overall_match = None
     best_overall_score = 0.0
     all_candidates = {}  # Store all unique candidates
+    nam_term_lower = nam_term.lower()
+    
+    keywords = extract_keywords(nam_def) if nam_def.strip() else []
+    symptom_phrases = [
+        "voice hoarseness",
+        "muscle twitching", 
+        "sleep disorders",
+        "constipation",
+        "skin discoloration",
+        "muscle weakness"
+    ]
+    
+    # Fire every unique search up front so the network round-trips overlap;
+    # results are still merged in priority order below
+    queries = {}
+    for query in [nam_term, *keywords, *symptom_phrases]:
+        queries.setdefault(query.lower(), query)
+    executor = ThreadPoolExecutor(max_workers=8)
+    futures = {key: executor.submit(search_icd, query) for key, query in queries.items()}
+    executor.shutdown(wait=False)
     
     # Priority 1: Try NAMASTE term
-    print(f"\n1. Searching with NAMASTE term: '{nam_term}'")
-    candidates = search_icd(nam_term, token)
-    print(f"   Found {len(candidates)} candidates")
+    log.info("1. Searching with NAMASTE term: '%s'", nam_term)
+    candidates = futures[nam_term_lower].result()
+    log.info("   Found %d candidates", len(candidates))
     
     if candidates:
-        for c in candidates:
-            title = c.get("title", "")
-            code = c.get("theCode", "")
-            score = similarity(nam_term, title)
+        codes, titles, titles_lower = zip(*candidates)
+        scores = score_titles([nam_term_lower], titles_lower)[0]
+        for code, title, score in zip(codes, titles, scores.tolist()):
             all_candidates[code] = (title, score, "NAMASTE_term")
-            print(f"   - {code}: {title} (similarity: {score:.3f})")
-            
-            if score > best_overall_score:
-                best_overall_score = score
-                best_overall_match = (code, title, "NAMASTE_term")
+            log.debug("   - %s: %s (similarity: %.3f)", code, title, score)
+        
+        best_idx = int(scores.argmax())
+        if scores[best_idx] > best_overall_score:
+            best_overall_score = float(scores[best_idx])
+            best_overall_match = (codes[best_idx], titles[best_idx], "NAMASTE_term")
+            if best_overall_score >= EARLY_EXIT:
+                return finalize_mapping(nam_code, nam_term, best_overall_match, best_overall_score, all_candidates, futures.values())
 
     # Priority 2: Try with extracted keywords from definition
     if nam_def.strip():
-        keywords = extract_keywords(nam_def)
-        print(f"\n2. Extracted keywords from definition: {keywords}")
+        log.info("2. Extracted keywords from definition: %s", keywords)
         
         for keyword in keywords:
-            print(f"\n   Searching with keyword: '{keyword}'")
-            candidates = search_icd(keyword, token)
-            print(f"   Found {len(candidates)} candidates")
+            log.info("   Searching with keyword: '%s'", keyword)
+            candidates = futures[keyword.lower()].result()
+            log.info("   Found %d candidates", len(candidates))
             
-            for c in candidates:
-                title = c.get("title", "")
-                code = c.get("theCode", "")
-                # Calculate similarity against the symptoms, not just the term
-                score_vs_term = similarity(nam_term, title)
-                score_vs_keyword = similarity(keyword, title)
-                # Use higher score for better matching
-                score = max(score_vs_term, score_vs_keyword * 0.8)
-                
+            if not candidates:
+                continue
+            
+            codes, titles, titles_lower = zip(*candidates)
+            # Calculate similarity against the symptoms, not just the term
+            scores_vs_term, scores_vs_keyword = score_titles([nam_term_lower, keyword.lower()], titles_lower)
+            # Use higher score for better matching
+            scores = np.maximum(scores_vs_term, scores_vs_keyword * 0.8)
+            
+            for code, title, score in zip(codes, titles, scores.tolist()):
                 if code not in all_candidates or score > all_candidates[code][1]:
                     all_candidates[code] = (title, score, f"keyword: {keyword}")
                 
-                print(f"   - {code}: {title} (similarity: {score:.3f})")
-                
-                if score > best_overall_score:
-                    best_overall_score = score
-                    best_overall_match = (code, title, f"keyword: {keyword}")
+                log.debug("   - %s: %s (similarity: %.3f)", code, title, score)
+            
+            best_idx = int(scores.argmax())
+            if scores[best_idx] > best_overall_score:
+                best_overall_score = float(scores[best_idx])
+                best_overall_match = (codes[best_idx], titles[best_idx], f"keyword: {keyword}")
+                if best_overall_score >= EARLY_EXIT:
+                    return finalize_mapping(nam_code, nam_term, best_overall_match, best_overall_score, all_candidates, futures.values())
 
     # Priority 3: Try with symptom combinations
-    symptom_phrases = [
-        "voice hoarseness",
-        "muscle twitching", 
-        "sleep disorders",
-        "constipation",
-        "skin discoloration",
-        "muscle weakness"
-    ]
-    
-    print(f"\n3. Searching with symptom combinations...")
+    log.info("3. Searching with symptom combinations...")
     for phrase in symptom_phrases:
-        print(f"\n   Searching with phrase: '{phrase}'")
-        candidates = search_icd(phrase, token)
-        print(f"   Found {len(candidates)} candidates")
+        log.info("   Searching with phrase: '%s'", phrase)
+        candidates = futures[phrase.lower()].result()
+        log.info("   Found %d candidates", len(candidates))
         
-        for c in candidates:
-            title = c.get("title", "")
-            code = c.get("theCode", "")
-            score = similarity(phrase, title) * 0.9  # Slightly lower weight for phrase matching
-            
+        if not candidates:
+            continue
+        
+        codes, titles, titles_lower = zip(*candidates)
+        scores = score_titles([phrase.lower()], titles_lower)[0] * 0.9  # Slightly lower weight for phrase matching
+        
+        for code, title, score in zip(codes, titles, scores.tolist()):
             if code not in all_candidates or score > all_candidates[code][1]:
                 all_candidates[code] = (title, score, f"symptom: {phrase}")
             
-            print(f"   - {code}: {title} (similarity: {score:.3f})")
-            
-            if score > best_overall_score:
-                best_overall_score = score
-                best_overall_match = (code, title, f"symptom: {phrase}")
+            log.debug("   - %s: %s (similarity: %.3f)", code, title, score)
+        
+        best_idx = int(scores.argmax())
+        if scores[best_idx] > best_overall_score:
+            best_overall_score = float(scores[best_idx])
+            best_overall_match = (codes[best_idx], titles[best_idx], f"symptom: {phrase}")
+            if best_overall_score >= EARLY_EXIT:
+                break
+
+    return finalize_mapping(nam_code, nam_term, best_overall_match, best_overall_score, all_candidates, futures.values())
 
+# --------------------
+# Step 6. Report and Save Mapping
+# --------------------
+def finalize_mapping(nam_code, nam_term, best_overall_match, best_overall_score, all_candidates, pending=()):
+    # Searches that have not started yet are no longer needed
+    for future in pending:
+        future.cancel()
+    
     # Results
     result = {
         "NAMASTE_CODE": nam_code,
@@ -185,22 +269,27 @@ def build_mapping_specific():
         "MATCH_SOURCE": best_overall_match[2] if best_overall_match else None
     }
     
-    print(f"\n=== FINAL RESULT ===")
-    print(f"NAMASTE: {nam_code} - {nam_term}")
-    print(f"ICD-11: {result['ICD11_CODE']} - {result['ICD11_TERM']}")
-    print(f"Similarity: {result['SIMILARITY']}")
-    print(f"Matched via: {result['MATCH_SOURCE']}")
+    summary = [
+        "\n=== FINAL RESULT ===",
+        f"NAMASTE: {nam_code} - {nam_term}",
+        f"ICD-11: {result['ICD11_CODE']} - {result['ICD11_TERM']}",
+        f"Similarity: {result['SIMILARITY']}",
+        f"Matched via: {result['MATCH_SOURCE']}",
+    ]
     
     # Show top 5 candidates for review
-    print(f"\n=== TOP CANDIDATES ===")
-    sorted_candidates = sorted(all_candidates.items(), key=lambda x: x[1][1], reverse=True)
-    for i, (code, (title, score, source)) in enumerate(sorted_candidates[:5]):
-        print(f"{i+1}. {code}: {title} (score: {score:.3f}, via: {source})")
+    summary.append("\n=== TOP CANDIDATES ===")
+    top_candidates = heapq.nlargest(5, all_candidates.items(), key=lambda x: x[1][1])
+    for i, (code, (title, score, source)) in enumerate(top_candidates):
+        summary.append(f"{i+1}. {code}: {title} (score: {score:.3f}, via: {source})")
+    print("\n".join(summary))
     
     # Save to CSV
-    out_df = pd.DataFrame([result])
     output_file = "vAtavRuddhiH_specific_mapping.csv"
-    out_df.to_csv(output_file, index=False)
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(result), lineterminator="\n")
+        writer.writeheader()
+        writer.writerow(result)
     print(f"\nMapping saved to {output_file}")
 
 # --------------------
@@ -212,4 +301,5 @@ if __name__ == "__main__":
     TOKEN_URL = os.getenv("TOKEN_URL")
     SEARCH_URL = os.getenv("SEARCH_URL")
 
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), format="%(message)s")
     build_mapping_specific()
@@ -1,30 +1,78 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
-import pandas as pd
-import requests
-from difflib import SequenceMatcher
+from pydantic import BaseModel, ConfigDict, Field
+import certifi
+import httpx
+import ssl
+import asyncio
+import numpy as np
+from rapidfuzz import fuzz, process
 import re
+from itertools import islice
+from collections import OrderedDict
+from bisect import bisect_left
+from contextlib import asynccontextmanager
 from typing import List, Dict, Optional
 import json
+import logging
+import hashlib
+import time
 import os
 from dotenv import load_dotenv
 
 # Load .env file
 load_dotenv()
 
-app = FastAPI(title="NAMASTE-ICD11 Mapping API")
+log = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    warm_task = asyncio.create_task(_warm_icd_cache())
+    yield
+    # Stop the warmer before closing the client it may still be using
+    warm_task.cancel()
+    await asyncio.gather(warm_task, return_exceptions=True)
+    await _http.aclose()
+
+app = FastAPI(title="NAMASTE-ICD11 Mapping API", lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+INDEX_HTML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "index.html")
+
+# The page never changes while the app runs, so read it and compute its ETag once
+with open(INDEX_HTML, "rb") as f:
+    _INDEX_HTML_BYTES = f.read()
+_INDEX_ETAG = f'"{hashlib.blake2b(_INDEX_HTML_BYTES, digest_size=8).hexdigest()}"'
+_INDEX_HEADERS = {
+    # Weak, since GZipMiddleware may send the same page as differently encoded bytes
+    "ETag": f"W/{_INDEX_ETAG}",
+    "Cache-Control": "public, max-age=300"
+}
 
 # Configuration
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 TOKEN_URL = os.getenv("TOKEN_URL")
 SEARCH_URL = os.getenv("SEARCH_URL")
+# Send all keywords as one ICD query instead of one request each. Off by default since the
+# search API may match space-separated words together rather than as alternatives.
+BATCH_KEYWORD_SEARCH = os.getenv("BATCH_KEYWORD_SEARCH", "false").lower() == "true"
+# How batched keywords are combined into one query, e.g. " OR " where the endpoint supports it
+BATCH_KEYWORD_JOINER = os.getenv("BATCH_KEYWORD_JOINER", " ")
+# A term hit scoring at least this skips the keyword searches altogether
+FAST_PATH_THRESHOLD = 0.95
+# Send the keyword searches alongside the term search instead of waiting for its result: lower
+# latency when the term has no near-exact hit, but the searches go out even when it does
+SPECULATIVE_KEYWORD_SEARCH = os.getenv("SPECULATIVE_KEYWORD_SEARCH", "false").lower() == "true"
 
 # Pydantic models
 class SearchRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
     query: str
+    top_k: int = Field(20, ge=1)  # Number of ICD candidates to return
 
 class ICDCandidate(BaseModel):
     code: str
@@ -54,787 +102,394 @@ NAMASTE_DATA = {
     }
 }
 
-# Token management
+# Shared async HTTP/2 client so concurrent ICD searches multiplex over pooled keep-alive connections
+_http = httpx.AsyncClient(
+    http2=True,
+    verify=ssl.create_default_context(cafile=certifi.where()),
+    timeout=httpx.Timeout(5.0, connect=2.0),
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+)
+
+# Token management: (access_token, monotonic expiry time)
 _token_cache = None
+_token_lock = asyncio.Lock()
+TOKEN_REFRESH_MARGIN = 60  # seconds before expiry to fetch a new token
+
+def _cached_token():
+    if _token_cache and _token_cache[1] > time.monotonic() + TOKEN_REFRESH_MARGIN:
+        return _token_cache[0]
+    return None
 
-def get_token():
+async def get_token():
     global _token_cache
-    if _token_cache:
-        return _token_cache
+    token = _cached_token()
+    if token:
+        return token
     
-    data = {
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "icdapi_access",
-        "grant_type": "client_credentials"
-    }
-    r = requests.post(TOKEN_URL, data=data)
-    r.raise_for_status()
-    _token_cache = r.json()["access_token"]
-    return _token_cache
+    async with _token_lock:
+        # Another request may have fetched the token while we waited
+        token = _cached_token()
+        if token:
+            return token
+        
+        requested_at = time.monotonic()
+        data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "scope": "icdapi_access",
+            "grant_type": "client_credentials"
+        }
+        r = await _http.post(TOKEN_URL, data=data)
+        r.raise_for_status()
+        payload = r.json()
+        _token_cache = (payload["access_token"], requested_at + payload.get("expires_in", 3600))
+    return _token_cache[0]
+
+# ICD search results keyed by (term, chapter filter); not tied to the rotating token
+ICD_CACHE_TTL = 3600  # seconds
+ICD_CHAPTER_FILTER = "26"
+ICD_CACHE_MAXSIZE = 4096
+# LRU of (expiry, entities) keyed by (normalized term, chapter); ICD search is case-insensitive,
+# so "Fever", "fever " and "fever" share one entry and one round-trip
+_search_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
 
-def search_icd(term, token):
+async def search_icd(term):
+    """Search ICD-11 for a term, or for a list of terms batched into one query"""
+    if isinstance(term, str):
+        term = term.strip().lower()
+    else:
+        term = BATCH_KEYWORD_JOINER.join(t.strip().lower() for t in term)
+    key = (term, ICD_CHAPTER_FILTER)
+    cached = _search_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        _search_cache.move_to_end(key)
+        return cached[1]
+    
+    # Only a cache miss needs a token, so fully cached requests never wait on the OAuth endpoint
+    token = await get_token()
     headers = {
         "Authorization": f"Bearer {token}",
         "Accept": "application/json",
         "Accept-Language": "en",
         "API-Version": "v2"
     }
-    params = {"q": term, "flatResults": "true", "chapterFilter": "26"}
-    r = requests.get(SEARCH_URL, headers=headers, params=params, verify=False)
+    params = {"q": term, "flatResults": "true", "chapterFilter": ICD_CHAPTER_FILTER}
+    r = await _http.get(SEARCH_URL, headers=headers, params=params)
     r.raise_for_status()
-    return r.json().get("destinationEntities", [])
+    entities = r.json().get("destinationEntities", [])
+    _search_cache[key] = (time.monotonic() + ICD_CACHE_TTL, entities)
+    _search_cache.move_to_end(key)
+    if len(_search_cache) > ICD_CACHE_MAXSIZE:
+        _search_cache.popitem(last=False)
+    return entities
+
+_STOP_WORDS = frozenset({'is', 'are', 'the', 'and', 'or', 'of', 'in', 'to', 'by', 'at', 'such', 'as', 'this', 'may', 'be', 'it', 'with', 'a', 'an', 'various', 'parts', 'body', 'functions', 'consequent', 'explained', 'marked', 'increase'})
+_MED_TERMS = ('movement', 'abdomen', 'fullness', 'aversion', 'cold', 'impaired', 'accumulation', 'roughness', 'hoarseness', 'voice', 'emaciation', 'blackish', 'discoloration', 'twitching', 'warmth', 'insomnia', 'strength', 'stools')
+# Whole words containing any medical term, found in one scan of the definition. Punctuation
+# is not a word character, so it already separates words without being stripped first.
+_MED_WORD_RE = re.compile(r'\b\w*(?:' + '|'.join(map(re.escape, _MED_TERMS)) + r')\w*')
+_COMPOUND_TERMS = (
+    ({'hoarseness', 'voice'}, 'hoarse voice'),
+    ({'hard', 'stools'}, 'hard stools'),
+    ({'physical', 'strength'}, 'weakness'),
+)
+_COMPOUND_TRIGGERS = frozenset().union(*(words for words, _ in _COMPOUND_TERMS))
 
 def extract_keywords(definition):
-    stop_words = {'is', 'are', 'the', 'and', 'or', 'of', 'in', 'to', 'by', 'at', 'such', 'as', 'this', 'may', 'be', 'it', 'with', 'a', 'an', 'various', 'parts', 'body', 'functions', 'consequent', 'explained', 'marked', 'increase'}
-    
-    clean_def = re.sub(r'[^\w\s]', ' ', definition.lower())
-    words = clean_def.split()
-    keywords = [word for word in words if len(word) > 3 and word not in stop_words]
+    definition_lower = definition.lower()
+    # Every match contains a medical term, so it is already longer than 3 characters
+    medical_keywords = [word for word in _MED_WORD_RE.findall(definition_lower) if word not in _STOP_WORDS]
     
-    medical_keywords = []
-    for word in keywords:
-        if any(term in word for term in ['movement', 'abdomen', 'fullness', 'aversion', 'cold', 'impaired', 'accumulation', 'roughness', 'hoarseness', 'voice', 'emaciation', 'blackish', 'discoloration', 'twitching', 'warmth', 'insomnia', 'strength', 'stools']):
-            medical_keywords.append(word)
+    present = {word for word in _COMPOUND_TRIGGERS if word in definition_lower}
+    compound_terms = [term for words, term in _COMPOUND_TERMS if words <= present]
     
-    compound_terms = []
-    if 'hoarseness' in definition.lower() and 'voice' in definition.lower():
-        compound_terms.append('hoarse voice')
-    if 'hard' in definition.lower() and 'stools' in definition.lower():
-        compound_terms.append('hard stools')
-    if 'physical' in definition.lower() and 'strength' in definition.lower():
-        compound_terms.append('weakness')
-    
-    all_keywords = medical_keywords + compound_terms
-    return all_keywords[:8]
+    # Drop repeats (keeping first-seen order) before capping so each ICD search is distinct
+    all_keywords = dict.fromkeys(medical_keywords + compound_terms)
+    return list(islice(all_keywords, 8))
+
+def search_keywords_for(entry):
+    """Keywords worth an ICD search of their own for a NAMASTE entry"""
+    # search_icd keys on the normalized query, so collapse keywords the same way before fanning
+    # out; one equal to the term would only repeat the term's hits at 0.8x and can never win
+    term_lc = entry["term_lc"].strip()
+    return [k for k in dict.fromkeys(k.strip().lower() for k in entry["keywords"]) if k and k != term_lc]
+
+# Definitions are static, so extract each entry's keywords and search set once at import
+for entry in NAMASTE_DATA.values():
+    entry["term_lc"] = entry["term"].lower()
+    entry["keywords"] = extract_keywords(entry["definition"])
+    entry["search_keywords"] = search_keywords_for(entry)
+
+# Lookup indexes for the static NAMASTE entries, built once at import. _SUFFIXES is a suffix
+# array over every lowercased code and term: "query is a substring of a key" becomes "query is a
+# prefix of one of its suffixes", and those suffixes form one contiguous, binary-searchable run.
+_CODE_LC = {code.lower(): code for code in NAMASTE_DATA}
+_CODES = list(NAMASTE_DATA)
+_SUFFIXES = sorted({
+    (key[i:], order)
+    for order, (code, entry) in enumerate(NAMASTE_DATA.items())
+    for key in (code.lower(), entry["term_lc"])
+    for i in range(len(key))
+})
+
+def find_namaste_entry(query):
+    """Exact code match first, then the first entry whose code or term contains the query"""
+    q = query.lower()
+    code = _CODE_LC.get(q)
+    if code is None:
+        lo = bisect_left(_SUFFIXES, (q,))
+        hi = bisect_left(_SUFFIXES, (q + "\U0010ffff",), lo)
+        order = min((order for _, order in _SUFFIXES[lo:hi]), default=None)
+        code = _CODES[order] if order is not None else None
+    return NAMASTE_DATA[code] if code is not None else None
+
+# Precompute the full response for every bundled NAMASTE entry, rebuilt whenever the search
+# cache expires, so /search for a known entry is a dict lookup with no WHO round trips.
+# Responses are also saved to disk so a restart within the TTL skips the warm-up. Each entry
+# carries its own wall-clock expiry; past it /search falls back to the live pipeline.
+PRECOMPUTED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "precomputed_mappings.json")
+PRECOMPUTED_SCHEMA_VERSION = 1  # Bump when scoring or the response model changes
+# Saved responses only count if built from the same NAMASTE data and schema version
+_PRECOMPUTED_VERSION = hashlib.blake2b(
+    json.dumps([PRECOMPUTED_SCHEMA_VERSION, NAMASTE_DATA], sort_keys=True).encode(), digest_size=8
+).hexdigest()
+WARM_RETRY_DELAY = 60  # seconds before retrying a failed warm-up
+_precomputed: Dict[str, tuple] = {}  # NAMASTE code -> (expiry, ConceptMapResponse)
+
+def _load_precomputed():
+    """Load saved responses that are still fresh and return how long until they need rebuilding"""
+    now = time.time()
+    try:
+        with open(PRECOMPUTED_FILE, "rb") as f:
+            saved = json.load(f)
+        if saved["version"] != _PRECOMPUTED_VERSION:
+            return 0
+        fresh = {
+            code: (expiry, ConceptMapResponse.model_validate(response))
+            for code, (expiry, response) in saved["responses"].items()
+            if code in NAMASTE_DATA and expiry > now
+        }
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return 0
+    _precomputed.update(fresh)
+    if len(fresh) < len(NAMASTE_DATA):
+        return 0
+    return min(expiry for expiry, _ in fresh.values()) - now
 
-def similarity(a, b):
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+def _save_precomputed():
+    """Write the responses to a temporary file and swap it in, so no worker reads a partial file"""
+    saved = {
+        "version": _PRECOMPUTED_VERSION,
+        "responses": {code: [expiry, response.model_dump()] for code, (expiry, response) in _precomputed.items()}
+    }
+    tmp_file = f"{PRECOMPUTED_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(saved, f)
+    os.replace(tmp_file, PRECOMPUTED_FILE)
+
+async def _warm_icd_cache():
+    delay = _load_precomputed()
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            responses = await asyncio.gather(*(build_concept_map(entry) for entry in NAMASTE_DATA.values()))
+            expiry = time.time() + ICD_CACHE_TTL
+            _precomputed.update((code, (expiry, response)) for code, response in zip(NAMASTE_DATA, responses))
+            _save_precomputed()
+        except Exception:
+            # Keep the warmer alive whatever went wrong; stale entries expire on their own
+            log.exception("Precomputing NAMASTE concept maps failed, retrying in %ss", WARM_RETRY_DELAY)
+            delay = WARM_RETRY_DELAY
+        else:
+            delay = ICD_CACHE_TTL
+
+def etag_matches(if_none_match, etag):
+    """Weakly compare an If-None-Match header, a list of tags or *, against an opaque ETag"""
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
 
 @app.get("/", response_class=HTMLResponse)
-async def get_frontend():
-    return """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Medical Concept Mapper - NAMASTE to ICD-11</title>
-        <script src="https://d3js.org/d3.v7.min.js"></script>
-        <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-            
-            body {
-                font-family: 'Poppins', sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                min-height: 100vh;
-                color: #333;
-            }
-            
-            .container {
-                max-width: 1600px;
-                margin: 0 auto;
-                padding: 20px;
-            }
-            
-            .header {
-                text-align: center;
-                margin-bottom: 30px;
-                color: white;
-            }
-            
-            .header h1 {
-                font-size: 3rem;
-                font-weight: 800;
-                margin-bottom: 15px;
-                text-shadow: 0 4px 8px rgba(0,0,0,0.3);
-                letter-spacing: -1px;
-            }
-            
-            .header p {
-                font-size: 1.3rem;
-                opacity: 0.95;
-                font-weight: 400;
-                text-shadow: 0 2px 4px rgba(0,0,0,0.2);
-            }
-            
-            .search-panel {
-                background: rgba(255, 255, 255, 0.98);
-                backdrop-filter: blur(20px);
-                border-radius: 25px;
-                padding: 40px;
-                margin-bottom: 30px;
-                box-shadow: 0 20px 60px rgba(0,0,0,0.15);
-                border: 1px solid rgba(255,255,255,0.3);
-            }
-            
-            .search-container {
-                display: flex;
-                gap: 20px;
-                align-items: center;
-                justify-content: center;
-                margin-bottom: 30px;
-            }
-            
-            .search-input {
-                flex: 1;
-                max-width: 500px;
-                padding: 18px 25px;
-                border: 3px solid #e8eaf6;
-                border-radius: 15px;
-                font-size: 18px;
-                transition: all 0.3s ease;
-                background: white;
-                font-family: 'Poppins', sans-serif;
-                font-weight: 500;
-            }
-            
-            .search-input:focus {
-                outline: none;
-                border-color: #667eea;
-                box-shadow: 0 0 0 4px rgba(102, 126, 234, 0.15);
-                transform: translateY(-2px);
-            }
-            
-            .search-btn {
-                padding: 18px 35px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                border: none;
-                border-radius: 15px;
-                font-size: 18px;
-                font-weight: 700;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                box-shadow: 0 8px 25px rgba(102, 126, 234, 0.4);
-                font-family: 'Poppins', sans-serif;
-                letter-spacing: 0.5px;
-            }
-            
-            .search-btn:hover {
-                transform: translateY(-3px);
-                box-shadow: 0 12px 35px rgba(102, 126, 234, 0.6);
-            }
-            
-            .concept-map-container {
-                background: linear-gradient(145deg, #ffffff 0%, #f8f9ff 100%);
-                border-radius: 25px;
-                box-shadow: 0 25px 80px rgba(0,0,0,0.15);
-                border: 2px solid rgba(255,255,255,0.8);
-                overflow: hidden;
-                min-height: 800px;
-                position: relative;
-            }
-            
-            .map-header {
-                padding: 30px 40px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                text-align: center;
-            }
-            
-            .map-header h3 {
-                font-size: 1.8rem;
-                font-weight: 700;
-                margin: 0;
-                text-shadow: 0 2px 4px rgba(0,0,0,0.2);
-                letter-spacing: 0.5px;
-            }
-            
-            .concept-map {
-                position: relative;
-                background: radial-gradient(circle at center, #f8f9ff 0%, #ffffff 100%);
-            }
-            
-            .node {
-                cursor: pointer;
-                transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1);
-            }
-            
-            .node:hover {
-                filter: brightness(1.15) saturate(1.2);
-                transform: scale(1.1);
-            }
-            
-            .link {
-                stroke: url(#linkGradient);
-                stroke-opacity: 0.8;
-                stroke-width: 3;
-                transition: all 0.3s ease;
-                filter: drop-shadow(0 2px 4px rgba(0,0,0,0.1));
-            }
-            
-            .namaste-node {
-                fill: url(#namasteGradient);
-                stroke: #d32f2f;
-                stroke-width: 4;
-                filter: drop-shadow(0 8px 16px rgba(244, 67, 54, 0.4));
-            }
-            
-            .icd-node {
-                fill: url(#icdGradient);
-                stroke: #5e7ce0;
-                stroke-width: 3;
-                filter: drop-shadow(0 6px 12px rgba(94, 124, 224, 0.3));
-            }
-            
-            .best-match-node {
-                fill: url(#bestMatchGradient);
-                stroke: #2e7d32;
-                stroke-width: 5;
-                filter: drop-shadow(0 10px 20px rgba(76, 175, 80, 0.5));
-                animation: bestMatchPulse 2.5s ease-in-out infinite;
-            }
-            
-            @keyframes bestMatchPulse {
-                0%, 100% { 
-                    transform: scale(1);
-                    filter: drop-shadow(0 10px 20px rgba(76, 175, 80, 0.5));
-                }
-                50% { 
-                    transform: scale(1.08);
-                    filter: drop-shadow(0 15px 30px rgba(76, 175, 80, 0.7));
-                }
-            }
-            
-            .code-label {
-                font-family: 'Poppins', sans-serif;
-                font-weight: 700;
-                text-anchor: middle;
-                pointer-events: none;
-                fill: white;
-                text-shadow: 0 2px 4px rgba(0,0,0,0.7);
-                dominant-baseline: central;
-            }
-            
-            .title-label {
-                font-family: 'Poppins', sans-serif;
-                font-weight: 600;
-                text-anchor: middle;
-                pointer-events: none;
-                fill: white;
-                text-shadow: 0 1px 3px rgba(0,0,0,0.6);
-            }
-            
-            .namaste-term-label {
-                font-family: 'Poppins', sans-serif;
-                font-weight: 800;
-                text-anchor: middle;
-                pointer-events: none;
-                fill: white;
-                text-shadow: 0 3px 6px rgba(0,0,0,0.8);
-                dominant-baseline: central;
-            }
-            
-            .tooltip {
-                position: absolute;
-                background: linear-gradient(145deg, rgba(0, 0, 0, 0.95), rgba(20, 20, 20, 0.95));
-                color: white;
-                padding: 20px 25px;
-                border-radius: 15px;
-                font-size: 14px;
-                line-height: 1.6;
-                pointer-events: none;
-                opacity: 0;
-                transition: all 0.3s ease;
-                max-width: 350px;
-                box-shadow: 0 15px 40px rgba(0,0,0,0.4);
-                backdrop-filter: blur(20px);
-                border: 1px solid rgba(255,255,255,0.1);
-                font-family: 'Poppins', sans-serif;
-                font-weight: 500;
-            }
-            
-            .loading {
-                text-align: center;
-                padding: 60px;
-                color: #667eea;
-                font-weight: 600;
-            }
-            
-            .spinner {
-                border: 4px solid #e3f2fd;
-                border-top: 4px solid #667eea;
-                border-radius: 50%;
-                width: 50px;
-                height: 50px;
-                animation: spin 1.2s linear infinite;
-                margin: 0 auto 30px;
-            }
-            
-            @keyframes spin {
-                0% { transform: rotate(0deg); }
-                100% { transform: rotate(360deg); }
-            }
-            
-            .error-message {
-                background: linear-gradient(135deg, #ffebee 0%, #ffcdd2 100%);
-                color: #c62828;
-                padding: 20px 25px;
-                border-radius: 12px;
-                margin: 30px;
-                border: 2px solid #ef5350;
-                font-weight: 600;
-                text-align: center;
-            }
-            
-            .crown-icon {
-                font-size: 20px;
-                margin-right: 8px;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🔬 Medical Concept Mapper</h1>
-                <p>Intelligent Mapping of NAMASTE Ayurvedic Terms to ICD-11 Classifications</p>
-            </div>
-            
-            <div class="search-panel">
-                <div class="search-container">
-                    <input type="text" class="search-input" id="searchInput" 
-                           placeholder="🔍 Enter NAMASTE code or term (e.g. 'vAtavRuddhiH', 'SR12', '6')">
-                    <button class="search-btn" onclick="searchMapping()">
-                        <span id="btnText">🚀 Analyze Mapping</span>
-                    </button>
-                </div>
-            </div>
-            
-            <div class="concept-map-container">
-                <div class="map-header">
-                    <h3>🎯 Interactive Concept Relationship Network</h3>
-                </div>
-                <div class="concept-map" id="conceptMap">
-                    <div class="loading" style="display: none;" id="loading">
-                        <div class="spinner"></div>
-                        <p>🧠 Analyzing medical concepts and finding ICD-11 matches...</p>
-                    </div>
-                </div>
-            </div>
-        </div>
+async def get_frontend(request: Request):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, _INDEX_ETAG):
+        return Response(status_code=304, headers=_INDEX_HEADERS)
+    return Response(content=_INDEX_HTML_BYTES, media_type="text/html", headers=_INDEX_HEADERS)
+
+def score_hits(term_lc, search_keywords, term_hits, keyword_hits):
+    """Term score per unique title, and the fused term/keyword score per keyword hit"""
+    # The term and keywords come in lowercased, so each title is lowercased once here and the
+    # scorers run without a per-call processor
+    # Score every unique title against the NAMASTE term natively
+    titles = list(dict.fromkeys(title for hits in [term_hits, *keyword_hits] for _, title in hits))
+    term_scores = {}
+    keyword_scores = []
+    if titles:
+        titles_lc = [title.lower() for title in titles]
+        term_row = process.cdist([term_lc], titles_lc, scorer=fuzz.ratio, dtype=np.float32)[0]
+        term_scores = dict(zip(titles, (term_row / 100.0).tolist()))
         
-        <div class="tooltip" id="tooltip"></div>
-
-        <script>
-            async function searchMapping() {
-                const query = document.getElementById('searchInput').value.trim();
-                if (!query) {
-                    showError('⚠️ Please enter a search term');
-                    return;
-                }
-                
-                showLoading(true);
-                
-                try {
-                    const response = await fetch('/search', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ query: query })
-                    });
-                    
-                    if (!response.ok) {
-                        const error = await response.json();
-                        throw new Error(error.detail || 'Search failed');
-                    }
-                    
-                    const data = await response.json();
-                    createConceptMap(data);
-                } catch (error) {
-                    showError('❌ Error: ' + error.message);
-                } finally {
-                    showLoading(false);
-                }
-            }
-            
-            function showLoading(show) {
-                const loading = document.getElementById('loading');
-                const btnText = document.getElementById('btnText');
-                
-                loading.style.display = show ? 'block' : 'none';
-                btnText.innerHTML = show ? '⏳ Analyzing...' : '🚀 Analyze Mapping';
-                
-                if (!show) {
-                    const existing = document.querySelector('.error-message');
-                    if (existing) existing.remove();
-                }
-            }
-            
-            function showError(message) {
-                const mapContainer = document.getElementById('conceptMap');
-                const existing = document.querySelector('.error-message');
-                if (existing) existing.remove();
-                
-                const errorDiv = document.createElement('div');
-                errorDiv.className = 'error-message';
-                errorDiv.innerHTML = message;
-                mapContainer.appendChild(errorDiv);
-            }
-            
-            function createConceptMap(data) {
-                const mapContainer = d3.select("#conceptMap");
-                mapContainer.selectAll("*").remove();
-                
-                const width = 1400;
-                const height = 800;
-                
-                const svg = mapContainer
-                    .append("svg")
-                    .attr("width", width)
-                    .attr("height", height);
-                
-                // Define gradients and patterns
-                const defs = svg.append("defs");
-                
-                // Gradient for NAMASTE node
-                const namasteGradient = defs.append("radialGradient")
-                    .attr("id", "namasteGradient")
-                    .attr("cx", "30%")
-                    .attr("cy", "30%");
-                namasteGradient.append("stop")
-                    .attr("offset", "0%")
-                    .attr("stop-color", "#ff6b6b");
-                namasteGradient.append("stop")
-                    .attr("offset", "100%")
-                    .attr("stop-color", "#e53e3e");
-                
-                // Gradient for ICD nodes
-                const icdGradient = defs.append("radialGradient")
-                    .attr("id", "icdGradient")
-                    .attr("cx", "30%")
-                    .attr("cy", "30%");
-                icdGradient.append("stop")
-                    .attr("offset", "0%")
-                    .attr("stop-color", "#74b9ff");
-                icdGradient.append("stop")
-                    .attr("offset", "100%")
-                    .attr("stop-color", "#0984e3");
-                
-                // Gradient for best match
-                const bestMatchGradient = defs.append("radialGradient")
-                    .attr("id", "bestMatchGradient")
-                    .attr("cx", "30%")
-                    .attr("cy", "30%");
-                bestMatchGradient.append("stop")
-                    .attr("offset", "0%")
-                    .attr("stop-color", "#00b894");
-                bestMatchGradient.append("stop")
-                    .attr("offset", "100%")
-                    .attr("stop-color", "#00a085");
-                
-                // Gradient for links
-                const linkGradient = defs.append("linearGradient")
-                    .attr("id", "linkGradient")
-                    .attr("x1", "0%")
-                    .attr("y1", "0%")
-                    .attr("x2", "100%")
-                    .attr("y2", "100%");
-                linkGradient.append("stop")
-                    .attr("offset", "0%")
-                    .attr("stop-color", "#a29bfe");
-                linkGradient.append("stop")
-                    .attr("offset", "100%")
-                    .attr("stop-color", "#6c5ce7");
-                
-                // Create nodes and links
-                const nodes = [];
-                const links = [];
-                
-                // Central NAMASTE node
-                const namasteNode = {
-                    id: 'namaste',
-                    label: data.namaste_term,
-                    code: data.namaste_code,
-                    type: 'namaste',
-                    fullInfo: `<strong>📋 ${data.namaste_code}</strong><br><strong>🏛️ ${data.namaste_term}</strong><br><br>📝 ${data.namaste_definition}`,
-                    displayCode: data.namaste_code
-                };
-                nodes.push(namasteNode);
-                
-                // ICD candidate nodes
-                const topCandidates = data.icd_candidates.slice(0, 8);
-                topCandidates.forEach((candidate, i) => {
-                    const isBest = data.best_match && candidate.code === data.best_match.code;
-                    const candidateNode = {
-                        id: `icd_${i}`,
-                        label: candidate.title.length > 25 ? candidate.title.substring(0, 25) + '...' : candidate.title,
-                        code: candidate.code,
-                        fullLabel: candidate.title,
-                        type: isBest ? 'best' : 'icd',
-                        fullInfo: `${isBest ? '<span class="crown-icon">👑</span>' : '🔗'} <strong>ICD-11:</strong> ${candidate.code}<br><br><strong>📊 Title:</strong> ${candidate.title}<br><br><strong>📈 Similarity:</strong> ${(candidate.similarity * 100).toFixed(1)}%<br><br><strong>🔍 Source:</strong> ${candidate.source}${isBest ? '<br><br><strong>🏆 BEST MATCH</strong>' : ''}`,
-                        similarity: candidate.similarity,
-                        isBest: isBest,
-                        displayCode: candidate.code
-                    };
-                    nodes.push(candidateNode);
-                    links.push({ 
-                        source: 'namaste', 
-                        target: `icd_${i}`, 
-                        strength: isBest ? 1.0 : 0.6 + (candidate.similarity * 0.4)
-                    });
-                });
-                
-                // Create force simulation
-                const simulation = d3.forceSimulation(nodes)
-                    .force("link", d3.forceLink(links).id(d => d.id).distance(d => 180 + (d.strength * 60)))
-                    .force("charge", d3.forceManyBody().strength(-800))
-                    .force("center", d3.forceCenter(width / 2, height / 2))
-                    .force("collision", d3.forceCollide().radius(80));
-                
-                // Create links
-                const link = svg.append("g")
-                    .selectAll("line")
-                    .data(links)
-                    .enter().append("line")
-                    .attr("class", "link")
-                    .style("stroke-width", d => 3 + (d.strength * 4))
-                    .style("stroke-opacity", d => 0.6 + (d.strength * 0.3));
-                
-                // Create nodes
-                const node = svg.append("g")
-                    .selectAll("circle")
-                    .data(nodes)
-                    .enter().append("circle")
-                    .attr("class", d => `node ${d.type}-node`)
-                    .attr("r", d => {
-                        if (d.type === 'namaste') return 70;
-                        if (d.type === 'best') return 60;
-                        return 45;
-                    })
-                    .call(d3.drag()
-                        .on("start", dragstarted)
-                        .on("drag", dragged)
-                        .on("end", dragended));
-                
-                // Add code labels
-                const codeText = svg.append("g")
-                    .selectAll("text")
-                    .data(nodes)
-                    .enter().append("text")
-                    .attr("class", "code-label")
-                    .text(d => d.displayCode)
-                    .style("font-size", d => {
-                        if (d.type === 'namaste') return '16px';
-                        if (d.type === 'best') return '14px';
-                        return '12px';
-                    });
-                
-                // Add title labels for ICD nodes
-                const titleText = svg.append("g")
-                    .selectAll("text")
-                    .data(nodes.filter(d => d.type !== 'namaste'))
-                    .enter().append("text")
-                    .attr("class", "title-label")
-                    .style("font-size", d => {
-                        if (d.type === 'best') return '11px';
-                        return '9px';
-                    })
-                    .each(function(d) {
-                        const textElement = d3.select(this);
-                        const words = d.label.split(' ');
-                        const maxCharsPerLine = d.type === 'best' ? 12 : 10;
-                        
-                        let line = [];
-                        let lineNumber = 0;
-                        
-                        for (let i = 0; i < words.length && lineNumber < 3; i++) {
-                            const testLine = line.concat(words[i]).join(' ');
-                            if (testLine.length > maxCharsPerLine && line.length > 0) {
-                                textElement.append("tspan")
-                                    .attr("x", 0)
-                                    .attr("dy", lineNumber === 0 ? "1.2em" : "1.1em")
-                                    .text(line.join(' '));
-                                line = [words[i]];
-                                lineNumber++;
-                            } else {
-                                line.push(words[i]);
-                            }
-                        }
-                        
-                        if (line.length > 0 && lineNumber < 3) {
-                            textElement.append("tspan")
-                                .attr("x", 0)
-                                .attr("dy", lineNumber === 0 ? "1.2em" : "1.1em")
-                                .text(line.join(' '));
-                        }
-                    });
-                
-                // NAMASTE term label
-                const namasteText = svg.append("g")
-                    .selectAll("text")
-                    .data(nodes.filter(d => d.type === 'namaste'))
-                    .enter().append("text")
-                    .attr("class", "namaste-term-label")
-                    .text(d => d.label)
-                    .style("font-size", "18px");
-                
-                // Tooltip
-                const tooltip = d3.select("#tooltip");
-                
-                node
-                    .on("mouseover", function(event, d) {
-                        tooltip.transition().duration(200).style("opacity", 1);
-                        tooltip.html(d.fullInfo)
-                            .style("left", (event.pageX + 20) + "px")
-                            .style("top", (event.pageY - 10) + "px");
-                        
-                        // Highlight effects
-                        d3.select(this).style("filter", "brightness(1.3) saturate(1.5)");
-                        link.style("stroke-opacity", l => 
-                            (l.source.id === d.id || l.target.id === d.id) ? 1 : 0.2
-                        );
-                    })
-                    .on("mouseout", function(d) {
-                        tooltip.transition().duration(300).style("opacity", 0);
-                        d3.select(this).style("filter", null);
-                        link.style("stroke-opacity", d => 0.6 + (d.strength * 0.3));
-                    });
-                
-                // Update positions
-                simulation.on("tick", () => {
-                    link
-                        .attr("x1", d => d.source.x)
-                        .attr("y1", d => d.source.y)
-                        .attr("x2", d => d.target.x)
-                        .attr("y2", d => d.target.y);
-                    
-                    node
-                        .attr("cx", d => Math.max(80, Math.min(width - 80, d.x)))
-                        .attr("cy", d => Math.max(80, Math.min(height - 80, d.y)));
-                    
-                    codeText
-                        .attr("x", d => Math.max(80, Math.min(width - 80, d.x)))
-                        .attr("y", d => {
-                            const y = Math.max(80, Math.min(height - 80, d.y));
-                            return d.type === 'namaste' ? y - 20 : y - 15;
-                        });
-                    
-                    titleText
-                        .attr("x", d => Math.max(80, Math.min(width - 80, d.x)))
-                        .attr("y", d => {
-                            const y = Math.max(80, Math.min(height - 80, d.y));
-                            return y + 10;
-                        });
-                    
-                    namasteText
-                        .attr("x", d => Math.max(80, Math.min(width - 80, d.x)))
-                        .attr("y", d => Math.max(80, Math.min(height - 80, d.y)));
-                });
-                
-                function dragstarted(event, d) {
-                    if (!event.active) simulation.alphaTarget(0.3).restart();
-                    d.fx = d.x;
-                    d.fy = d.y;
-                }
-                
-                function dragged(event, d) {
-                    d.fx = event.x;
-                    d.fy = event.y;
-                }
-                
-                function dragended(event, d) {
-                    if (!event.active) simulation.alphaTarget(0);
-                    d.fx = null;
-                    d.fy = null;
-                }
-            }
-            
-            document.getElementById('searchInput').addEventListener('keypress', function(e) {
-                if (e.key === 'Enter') {
-                    searchMapping();
-                }
-            });
-        </script>
-    </body>
-    </html>
-    """
+        # Each keyword only competes for the hits its own search returned, so score just those
+        # (keyword, title) pairs instead of every keyword against every title
+        pair_keywords = [keyword for keyword, hits in zip(search_keywords, keyword_hits) for _ in hits]
+        pair_titles = [title for hits in keyword_hits for _, title in hits]
+        if pair_titles:
+            title_index = {title: i for i, title in enumerate(titles)}
+            pair_index = [title_index[title] for title in pair_titles]
+            pair_term = term_row[pair_index]
+            pair_titles_lc = [titles_lc[i] for i in pair_index]
+            
+            # A keyword score only counts when 0.8x it beats the term score, so anything under the
+            # lowest term score / 0.8 can never win; rapidfuzz skips those pairs and returns 0
+            cutoff = min(100.0, float(pair_term.min()) / 0.8)
+            pair_scores = process.cpdist(pair_keywords, pair_titles_lc, scorer=fuzz.ratio, dtype=np.float32,
+                                         score_cutoff=cutoff)
+            # Fuse max(term score, 0.8x keyword score) for every pair in one vector op
+            keyword_scores = (np.maximum(pair_term, pair_scores * np.float32(0.8)) / 100.0).tolist()
+    return term_scores, keyword_scores
+
+# In-flight /search computations keyed by NAMASTE code
+_inflight: Dict[str, asyncio.Task] = {}
+
+async def search_keyword_results(search_keywords):
+    """ICD search results per keyword, from one search each or one batched search"""
+    if not (BATCH_KEYWORD_SEARCH and search_keywords):
+        return await asyncio.gather(*(search_icd(keyword) for keyword in search_keywords))
+    
+    # Credit each unique hit of the batched keyword search to the keyword it matches best
+    keyword_results = [[] for _ in search_keywords]
+    seen_codes = set()
+    for c in await search_icd(search_keywords):
+        code = c.get("theCode", "")
+        if code in seen_codes:
+            continue
+        seen_codes.add(code)
+        title = c.get("title", "")
+        _, _, best_keyword = process.extractOne(title, search_keywords, scorer=fuzz.ratio, processor=str.lower)
+        keyword_results[best_keyword].append(c)
+    return keyword_results
+
+async def build_concept_map(namaste_entry):
+    keywords = namaste_entry["keywords"]
+    search_keywords = namaste_entry["search_keywords"]
+    
+    # Search ICD-11 with the term first; the keywords are only searched when the term has no
+    # near-exact hit, unless speculative search sends them alongside the term
+    keyword_search = None
+    if SPECULATIVE_KEYWORD_SEARCH:
+        keyword_search = asyncio.ensure_future(search_keyword_results(search_keywords))
+    try:
+        term_results = await search_icd(namaste_entry["term"])
+    except BaseException:
+        if keyword_search is not None:
+            # Retrieve the keyword searches' outcome too, or an error they already raised goes unread
+            keyword_search.cancel()
+            await asyncio.gather(keyword_search, return_exceptions=True)
+        raise
+    
+    # Keep only hits that have both a code and a title
+    term_hits = [(c["theCode"], c["title"]) for c in term_results if c.get("title") and c.get("theCode")]
+    
+    if term_hits and process.extractOne(namaste_entry["term"], [title for _, title in term_hits], scorer=fuzz.ratio,
+                                        processor=str.lower, score_cutoff=FAST_PATH_THRESHOLD * 100):
+        # The term alone found a near-exact match, so keyword expansion can't add anything useful
+        if keyword_search is not None:
+            keyword_search.cancel()
+            await asyncio.gather(keyword_search, return_exceptions=True)
+        search_keywords, keyword_results = [], []
+    elif keyword_search is not None:
+        keyword_results = await keyword_search
+    else:
+        keyword_results = await search_keyword_results(search_keywords)
+    
+    keyword_hits = [
+        [(c["theCode"], c["title"]) for c in candidates if c.get("title") and c.get("theCode")]
+        for candidates in keyword_results
+    ]
+    
+    # Scoring is CPU-bound, so keep it off the event loop; rapidfuzz releases the GIL while it runs
+    term_scores, keyword_scores = await asyncio.to_thread(
+        score_hits, namaste_entry["term_lc"], search_keywords, term_hits, keyword_hits
+    )
+    
+    # Every hit as parallel code/title/score/source lists, term hits first
+    codes = [code for hits in [term_hits, *keyword_hits] for code, _ in hits]
+    hit_titles = [title for hits in [term_hits, *keyword_hits] for _, title in hits]
+    scores = [term_scores[title] for _, title in term_hits] + keyword_scores
+    sources = ["NAMASTE_term"] * len(term_hits) + [
+        f"keyword: {keyword}" for keyword, hits in zip(search_keywords, keyword_hits) for _ in hits
+    ]
+    
+    # A stable descending sort puts each code's earliest highest-scoring hit first, so keeping
+    # the first hit per code both deduplicates and ranks the candidates
+    order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")
+    seen = set()
+    ranked = [i for i in order.tolist() if not (codes[i] in seen or seen.add(codes[i]))]
+    
+    # Convert to response format as plain dicts; the response model validates them in one pass
+    icd_candidates = [
+        {"code": codes[i], "title": hit_titles[i], "similarity": round(scores[i], 3), "source": sources[i]}
+        for i in ranked
+    ]
+    best_match = icd_candidates[0] if ranked and scores[ranked[0]] > 0 else None
+    
+    return ConceptMapResponse.model_validate({
+        "namaste_code": namaste_entry["code"],
+        "namaste_term": namaste_entry["term"],
+        "namaste_definition": namaste_entry["definition"],
+        "extracted_keywords": keywords,
+        "icd_candidates": icd_candidates,
+        "best_match": best_match
+    })
+
+def top_k_response(response, top_k):
+    """A concept map keeping only its top_k candidates"""
+    # Candidates are stored ranked and complete, so one cached map serves every top_k; the
+    # shallow copy shares the already-validated candidate models instead of rebuilding them
+    return response.model_copy(update={"icd_candidates": response.icd_candidates[:top_k]})
 
 @app.post("/search", response_model=ConceptMapResponse)
 async def search_namaste_mapping(request: SearchRequest):
-    query = request.query.strip()
+    query = request.query
     
     # Find NAMASTE entry
-    namaste_entry = None
-    for code, entry in NAMASTE_DATA.items():
-        if (query.lower() in code.lower() or 
-            query.lower() in entry["term"].lower() or
-            query == code):
-            namaste_entry = entry
-            break
+    namaste_entry = find_namaste_entry(query)
     
     if not namaste_entry:
-        raise HTTPException(status_code=404, detail=f"NAMASTE entry not found for query: '{query}'. Available entries: {list(NAMASTE_DATA.keys())}")
+        raise HTTPException(status_code=404, detail=f"NAMASTE entry not found for query: '{query}'. Example codes: {list(islice(NAMASTE_DATA, 10))}")
+    
+    precomputed = _precomputed.get(namaste_entry["code"])
+    if precomputed is not None and precomputed[0] > time.time():
+        return top_k_response(precomputed[1], request.top_k)
+    
+    # Identical concurrent lookups share one in-flight computation
+    key = namaste_entry["code"]
+    pending = _inflight.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(build_concept_map(namaste_entry))
+        _inflight[key] = pending
+        # Also read the outcome: if every waiter disconnected, nothing else would retrieve an error
+        pending.add_done_callback(lambda t: (_inflight.pop(key, None), t.cancelled() or t.exception()))
     
     try:
-        token = get_token()
-        
-        # Extract keywords
-        keywords = extract_keywords(namaste_entry["definition"])
-        
-        # Search ICD-11
-        all_candidates = {}
-        
-        # Search with NAMASTE term
-        candidates = search_icd(namaste_entry["term"], token)
-        for c in candidates:
-            title = c.get("title", "")
-            code = c.get("theCode", "")
-            if title and code:
-                score = similarity(namaste_entry["term"], title)
-                all_candidates[code] = (title, score, "NAMASTE_term")
-        
-        # Search with keywords
-        for keyword in keywords:
-            candidates = search_icd(keyword, token)
-            for c in candidates:
-                title = c.get("title", "")
-                code = c.get("theCode", "")
-                if title and code:
-                    score_vs_term = similarity(namaste_entry["term"], title)
-                    score_vs_keyword = similarity(keyword, title)
-                    score = max(score_vs_term, score_vs_keyword * 0.8)
-                    
-                    if code not in all_candidates or score > all_candidates[code][1]:
-                        all_candidates[code] = (title, score, f"keyword: {keyword}")
-        
-        # Convert to response format
-        icd_candidates = []
-        best_match = None
-        best_score = 0.0
-        
-        for code, (title, score, source) in all_candidates.items():
-            candidate = ICDCandidate(
-                code=code,
-                title=title,
-                similarity=round(score, 3),
-                source=source
-            )
-            icd_candidates.append(candidate)
-            
-            if score > best_score:
-                best_score = score
-                best_match = candidate
-        
-        # Sort by similarity
-        icd_candidates.sort(key=lambda x: x.similarity, reverse=True)
-        
-        return ConceptMapResponse(
-            namaste_code=namaste_entry["code"],
-            namaste_term=namaste_entry["term"],
-            namaste_definition=namaste_entry["definition"],
-            extracted_keywords=keywords,
-            icd_candidates=icd_candidates,
-            best_match=best_match
-        )
+        # Shield so one client disconnecting doesn't cancel the lookup for the others
+        result = await asyncio.shield(pending)
+    
+    except httpx.HTTPError as e:
+        # Only failures talking to the ICD API become a handled error; anything else is a bug
+        # and goes to FastAPI's default 500 handling with its traceback intact
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}") from e
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    return top_k_response(result, request.top_k)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Worker processes need the app as an import string; each worker keeps its own caches
+    uvicorn.run(
+        "sample:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",  # uvloop/httptools when installed (uvicorn[standard]), asyncio/h11 otherwise
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        backlog=2048
+    )
\ No newline at end of file